@@ -1,130 +1,240 @@
 # Pablo Oliva Quintana
 # Date: 12/08/2024
 
-import csv
+import sys
 from collections import deque
 
+BLANK = sys.intern("_")  # Blank tape symbol
+
 # The parse_ntm_file function reads and parses the .csv file defining NTM's structure. It
 # extracts: machine's name, states, input and tape alphabets, start/accept/
-# reject states, and transition rules. The transitions are stored as dictionaries for easy lookup 
-# during the simulation. The output is a structured dictionary that represents the NTM configuration.
+# reject states, and transition rules. States and symbols are also numbered with small integer ids,
+# and the transitions are kept in a flat table indexed by state id and symbol id for the simulation.
+# The output is a structured dictionary that represents the NTM configuration.
+
+def _number(names):
+    """Assigns consecutive ids to names, in order of first appearance."""
+    name2id = {}
+    for name in names:
+        name2id.setdefault(name, len(name2id))
+    return name2id
+
+def _merge_equivalent_states(machine, states):
+    """Maps every state to the id of its equivalence class, grouping states that behave identically."""
+    outgoing = {q: [] for q in states}
+    for t in machine["transitions"]:
+        outgoing[t["current_state"]].append(t)
+    
+    # Start from {accept}, {reject}, {others} and split classes until all the states in a class have
+    # the same transitions: input symbol, class of the next state and move direction
+    halting = {machine["accept_state"]: 0, machine["reject_state"]: 1}
+    block = {q: halting.get(q, 2) for q in states}
+    num_blocks = len(set(block.values()))
+    while True:
+        signature = {q: (block[q], frozenset((t["input_symbol"], block[t["next_state"]], t["move_direction"])
+                                             for t in outgoing[q]))
+                     for q in states}
+        signature2id = _number(signature[q] for q in states)
+        block = {q: signature2id[signature[q]] for q in states}
+        if len(signature2id) == num_blocks:
+            return block
+        num_blocks = len(signature2id)
 
 def parse_ntm_file(file_name):
     """Parses the NTM CSV file and returns the machine's configuration."""
+    # The NTM format has no quoted fields, so each row can simply be split on commas
     with open(file_name, 'r') as f:
-        reader = csv.reader(f)
-        lines = list(reader)
+        lines = [row.split(",") for row in f.read().splitlines() if row]
 
     # Extract machine properties and transition rules into a dictionary
     machine = {
         "name": lines[0][0],  # Machine name
-        "states": lines[1],   # List of states
-        "input_alphabet": lines[2],  # Input alphabet
-        "tape_alphabet": lines[3],   # Tape alphabet
-        "start_state": lines[4][0],  # Start state
-        "accept_state": lines[5][0], # Accept state
-        "reject_state": lines[6][0], # Reject state
+        "states": [sys.intern(s) for s in lines[1]],          # List of states
+        "input_alphabet": [sys.intern(s) for s in lines[2]],  # Input alphabet
+        "tape_alphabet": [sys.intern(s) for s in lines[3]],   # Tape alphabet
+        "start_state": sys.intern(lines[4][0]),  # Start state
+        "accept_state": sys.intern(lines[5][0]), # Accept state
+        "reject_state": sys.intern(lines[6][0]), # Reject state
         "transitions": []            # List of transitions
     }
     
     # Parse transitions from the file and append them to the machine dictionary
     for line in lines[7:]:
         machine["transitions"].append({
-            "current_state": line[0],
-            "input_symbol": line[1],
-            "next_state": line[2],
-            "write_symbol": line[3],
-            "move_direction": line[4]
+            "current_state": sys.intern(line[0]),
+            "input_symbol": sys.intern(line[1]),
+            "next_state": sys.intern(line[2]),
+            "write_symbol": sys.intern(line[3]),
+            "move_direction": sys.intern(line[4])
         })
     
+    # Number every state and symbol, including any that only appear in the transitions. One more
+    # symbol id is reserved for input characters outside the alphabet; it has no transitions
+    transitions = machine["transitions"]
+    state2id = _number(machine["states"]
+                       + [machine["start_state"], machine["accept_state"], machine["reject_state"]]
+                       + [t["current_state"] for t in transitions]
+                       + [t["next_state"] for t in transitions])
+    sym2id = _number(machine["tape_alphabet"] + machine["input_alphabet"] + [BLANK]
+                     + [t["input_symbol"] for t in transitions])
+    if len(sym2id) > 255:
+        raise ValueError("The tape alphabet must have at most 255 symbols")
+    machine["state2id"] = state2id
+    machine["id2state"] = list(state2id)
+    
+    # Group equivalent states into classes, used to recognize configurations already reached
+    state_class = _merge_equivalent_states(machine, machine["id2state"])
+    machine["state_class"] = [state_class[q] for q in machine["id2state"]]
+    machine["sym2id"] = sym2id
+    machine["id2sym"] = list(sym2id)
+    machine["unknown_symbol"] = len(sym2id)
+    machine["num_symbols"] = num_symbols = len(sym2id) + 1
+    
+    # Group transitions in a flat table indexed by state id * number of symbols + symbol id, each
+    # entry listing (next state id, next state class, head move). The write symbol is left out, as
+    # the simulation does not apply it, and the head move is 0 for L (the head keeps its cell)
+    # and 1 for R
+    table = [()] * (len(state2id) * num_symbols)
+    for t in transitions:
+        index = state2id[t["current_state"]] * num_symbols + sym2id[t["input_symbol"]]
+        move = 0 if t["move_direction"] == "L" else 1
+        transition = (state2id[t["next_state"]], state_class[t["next_state"]], move)
+        table[index] = table[index] + (transition,)
+    machine["transition_table"] = table
+    
     return machine
 
-# The following class represents a single state of the NTM during execution.
-# It models the computation's current state, the tape contents, and the head's position.
+# A single state of the NTM during execution is stored as a plain (tape, head, state) tuple: the
+# tape as bytes holding one symbol id per cell, the position of the head, and the current state id.
 
-class Configuration:
-    def __init__(self, left, state, right):
-        self.left = left    # Tape contents to the left of the head
-        self.state = state  # Current state
-        self.right = right  # Tape contents under and to the right of the head
-    
-    def __repr__(self):
-        return f"({self.left}, {self.state}, {self.right})"
+def _symbols(ntm, tape, input_string):
+    """Decodes the symbol ids on the tape back into symbol names."""
+    id2sym, unknown = ntm["id2sym"], ntm["unknown_symbol"]
+    # Cells are never rewritten, so a cell with the unknown symbol id still holds its input character
+    return [input_string[i] if c == unknown else id2sym[c] for i, c in enumerate(tape)]
+
+def _fmt(ntm, config, input_string):
+    """Formats a (tape, head, state) configuration as (left, state, right) for the output."""
+    tape, head, state = config
+    symbols = _symbols(ntm, tape, input_string)
+    return f"({''.join(symbols[:head])}, {ntm['id2state'][state]}, {''.join(symbols[head:])})"
 
 # The simulate_ntm function is going to calculate the simulation of the NTM. It uses a Breadth-First-Search
 # algorithm, implementing a queue to explore all possible paths in a nondeterministical way.
+
+def _path_to(parent, state_class, config):
+    """Follows the parent links back from config to the start configuration."""
+    path = []
+    while config is not None:
+        path.append(config)
+        tape, head, state = config
+        config = parent[(tape, head, state_class[state])]
+    path.reverse()
+    return path
     
-def simulate_ntm(ntm, input_string, max_depth=1000000):
+def simulate_ntm(ntm, input_string, max_depth=1000000, record_trace=False):
     """Simulates the NTM using BFS."""
-    queue = deque([Configuration("", ntm["start_state"], input_string)])
+    # Input characters outside the alphabet get the reserved symbol id, which has no transitions
+    sym2id, unknown = ntm["sym2id"], ntm["unknown_symbol"]
+    num_symbols = ntm["num_symbols"]
+    blank = bytes((sym2id[BLANK],))
+    tape = bytes(sym2id.get(c, unknown) for c in input_string) or blank
+    start_state = ntm["state2id"][ntm["start_state"]]
+    state_class = ntm["state_class"]
+    queue = deque([(tape, 0, start_state)])
+    # Configuration each (tape, head, state class) was first reached from, so each is explored once
+    parent = {(tape, 0, state_class[start_state]): None}
+    # Bind the machine's lookups to locals once, outside the BFS loop
+    accept_state = ntm["state2id"][ntm["accept_state"]]
+    reject_state = ntm["state2id"][ntm["reject_state"]]
+    table = ntm["transition_table"]
     steps = 0  # Number of steps taken
-    explored = []  # To store visited configurations (this will measure nondeterminism)
+    generated = 1  # Configurations reached, counting repeats (this will measure nondeterminism)
+    trace = [] if record_trace else None  # Every explored configuration, in order
     
+    popleft, append = queue.popleft, queue.append  # Bound once, as they run for every configuration
     while queue and steps < max_depth:
         current_level = len(queue)
         for _ in range(current_level):
-            config = queue.popleft()
-            explored.append(config)
+            config = popleft()
+            if record_trace:
+                trace.append(config)
+            tape, head, state = config
             
             # Check if the current configuration reaches the accept state
-            if config.state == ntm["accept_state"]:
-                return explored, "accept", steps
+            if state == accept_state:
+                return generated, _path_to(parent, state_class, config), trace, "accept", steps
             
             # Check if the current configuration reaches the reject state
-            if config.state == ntm["reject_state"]:
-                return explored, "reject", steps
+            if state == reject_state:
+                return generated, _path_to(parent, state_class, config), trace, "reject", steps
             
-            # Process transitions
-            for transition in ntm["transitions"]:
-                if config.state == transition["current_state"] and (config.right or "_")[0] == transition["input_symbol"]:
-                    # Update the configuration based on the transition rules
-                    new_left = config.left + (config.right[0] if config.right else "_")
-                    new_state = transition["next_state"]
-                    new_right = (config.right[1:] if len(config.right) > 1 else "") + "_"
-                    if transition["move_direction"] == "L":
-                        new_left, new_right = new_left[:-1], new_left[-1] + new_right
-                    
-                    # Enqueue the new configuration
-                    queue.append(Configuration(new_left, new_state, new_right))
+            # Process the transitions that match the current state and the symbol under the head
+            head_sym = tape[head]
+            for new_state, new_class, move in table[state * num_symbols + head_sym]:
+                # The tape is never written, so the successors share it, growing it with a blank
+                # when the head moves past the end
+                new_tape, new_head = tape, head + move
+                if new_head == len(tape):
+                    new_tape = tape + blank
+                
+                # Enqueue the new configuration unless an equivalent one was reached before
+                generated += 1
+                key = (new_tape, new_head, new_class)
+                if key in parent:
+                    continue
+                parent[key] = config
+                new_config = (new_tape, new_head, new_state)
+                
+                # Halt as soon as an accept or reject configuration is generated, instead of when it
+                # is dequeued, unless its level is beyond max_depth and would never be explored
+                if (new_state == accept_state or new_state == reject_state) and steps + 1 < max_depth:
+                    if record_trace:
+                        trace.append(new_config)
+                    result = "accept" if new_state == accept_state else "reject"
+                    return generated, _path_to(parent, state_class, new_config), trace, result, steps + 1
+                append(new_config)
         
         steps += 1  # Increment depth level
 
-    return explored, "timed out", steps
+    return generated, None, trace, "timed out", steps
 
 # Calculates the degree of nondeterminism
-def calculate_nondeterminism(explored, depth):
-    return len(explored) / depth if depth > 0 else 0
+def calculate_nondeterminism(generated, depth):
+    return generated / depth if depth > 0 else 0
 
-# Outputs the results of the simulation
-def output_results(ntm, input_string, explored, result, depth, output_file="output.txt"):
+# Outputs the results of the simulation, building the report once for both the file and the console
+def output_results(ntm, input_string, generated, path, result, depth, output_file="output.txt", trace=None):
+    nondeterminism = calculate_nondeterminism(generated, depth)
+    lines = [
+        "--- Simulation Summary ---",
+        f"Machine: {ntm['name']}",
+        f"Input String: {input_string}",
+        f"Result: {result}",
+        f"Depth: {depth}",
+        f"Configurations Explored: {generated}",
+        f"Average Non-Determinism: {nondeterminism:.2f}",
+    ]
+    if trace is not None:
+        lines.append("\nDetailed Steps:")
+        lines.extend(f"Step {i + 1}: {_fmt(ntm, config, input_string)}" for i, config in enumerate(trace))
+    else:
+        lines.append("\nPath to Halting Configuration:")
+        if path is None:
+            lines.append("None, the simulation timed out")
+        else:
+            lines.extend(f"Step {i + 1}: {_fmt(ntm, config, input_string)}" for i, config in enumerate(path))
+    report = "\n".join(lines) + "\n"
+    
+    # Write simulation summary to file
     with open(output_file, 'w') as f:
-        # Write simulation summary to file
-        f.write(f"--- Simulation Summary ---\n")
-        f.write(f"Machine: {ntm['name']}\n")
-        f.write(f"Input String: {input_string}\n")
-        f.write(f"Result: {result}\n")
-        f.write(f"Depth: {depth}\n")
-        f.write(f"Configurations Explored: {len(explored)}\n")
-        nondeterminism = calculate_nondeterminism(explored, depth)
-        f.write(f"Average Non-Determinism: {nondeterminism:.2f}\n")
-        f.write("\nDetailed Steps:\n")
-        for i, config in enumerate(explored):
-            f.write(f"Step {i + 1}: {config}\n")
+        f.write(report)
     
     # Print simulation summary to console
-    print(f"--- Simulation Summary ---")
-    print(f"Machine: {ntm['name']}")
-    print(f"Input String: {input_string}")
-    print(f"Result: {result}")
-    print(f"Depth: {depth}")
-    print(f"Configurations Explored: {len(explored)}")
-    print(f"Average Non-Determinism: {nondeterminism:.2f}")
-    print("\nDetailed Steps:")
-    for i, config in enumerate(explored):
-        print(f"Step {i + 1}: {config}")
+    sys.stdout.write(report)
 
 # Example Usage
 ntm_config = parse_ntm_file('ends_with_bb_PabloOlivaQuintana.csv')  # Change file name to test different machines
 inputted_string = "aaa"  # Change input string to test different inputs
-explored_configs, result, depth = simulate_ntm(ntm_config, inputted_string)  
-output_results(ntm_config, inputted_string, explored_configs, result, depth, output_file="simulation_output.txt")
\ No newline at end of file
+generated, path, trace, result, depth = simulate_ntm(ntm_config, inputted_string, record_trace=True)  # Leave out record_trace to only print the path
+output_results(ntm_config, inputted_string, generated, path, result, depth, output_file="simulation_output.txt", trace=trace)
\ No newline at end of file